@@ -2,23 +2,77 @@ import os
 import random
 import math
 import time
+import struct
+
+
+# Primos usados na divisão por tentativa (roda) antes do Miller-Rabin
+PRIMOS_PEQUENOS = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53)
+# Todo n sem fator em PRIMOS_PEQUENOS e menor que 59² é primo
+LIMITE_RODA = 59 * 59
+# Abaixo deste valor a divisão por tentativa ainda é mais barata que o Miller-Rabin
+LIMITE_DIVISAO = 100_000
+# Bases do Miller-Rabin determinístico: (2, 7, 61) vale para n < 4_759_123_141;
+# os 13 primeiros primos (até 41) valem para n < 3_317_044_064_679_887_385_961_981 (~3.3 * 10**24).
+# Acima disso o teste é apenas probabilístico (nenhum composto conhecido passa por essas bases).
+BASES_32 = (2, 7, 61)
+LIMITE_BASES_32 = 4_759_123_141
+BASES_64 = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+# Cada número trafega no pipe como inteiro binário de 8 bytes (little-endian)
+FORMATO_NUMERO = struct.Struct('<q')
 
 
 def verifica_primo(n: int) -> bool:
     if n < 2:
         return False
-    if n == 2:
+
+    # Divisão pelos primos pequenos elimina a maior parte dos compostos
+    for p in PRIMOS_PEQUENOS:
+        if n % p == 0:
+            return n == p
+    if n < LIMITE_RODA:
         return True
-    if n % 2 == 0:
-        return False
-    raiz = int(math.sqrt(n)) + 1
-    for i in range(3, raiz, 2):
-        if n % i == 0:
+
+    # n pequeno: divisão por tentativa com raiz inteira (sem passar por float)
+    if n < LIMITE_DIVISAO:
+        limite = math.isqrt(n)
+        i = 59
+        while i <= limite:
+            if n % i == 0:
+                return False
+            i += 2
+        return True
+
+    # Miller-Rabin: n - 1 = 2^s * d, com d ímpar
+    s = ((n - 1) & -(n - 1)).bit_length() - 1
+    d = (n - 1) >> s
+
+    bases = BASES_32 if n < LIMITE_BASES_32 else BASES_64
+    for a in bases:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
             return False
     return True
 
 
 
+def ler_exato(fd: int, tam: int) -> bytes:
+    # os.read pode devolver menos bytes que o pedido; lê até completar (ou EOF)
+    buf = b''
+    while len(buf) < tam:
+        parte = os.read(fd, tam - len(buf))
+        if not parte:
+            break
+        buf += parte
+    return buf
+
+
 def produtor_consumidor(qtd_numeros: int):
 
     #Cria os Ids para leitura e escrita
@@ -34,17 +88,13 @@ def produtor_consumidor(qtd_numeros: int):
 
         while True:
 
-            # Aqui foi padronizado na leitura de 20 bytes
-            data = os.read(id_consumidor, 20)
-            if not data:
+            # Cada mensagem tem exatamente FORMATO_NUMERO.size bytes
+            data = ler_exato(id_consumidor, FORMATO_NUMERO.size)
+            if len(data) < FORMATO_NUMERO.size:
                 break
 
             # Traduz os dados
-            num_str = data.decode().strip()
-            if not num_str:
-                continue
-
-            n = int(num_str)
+            (n,) = FORMATO_NUMERO.unpack(data)
 
             if n == 0:
                 print("[Consumidor] Recebido 0. FIM")
@@ -70,8 +120,8 @@ def produtor_consumidor(qtd_numeros: int):
 
             print(f"[Produtor] Inserindo no pipe {N}.")
 
-            #escreve uma string de exatos 20 bytes
-            msg = f"{N:<20}".encode()
+            #escreve o número como inteiro binário de 8 bytes
+            msg = FORMATO_NUMERO.pack(N)
 
             # grava no pipe
             os.write(id_produtor, msg)
@@ -79,7 +129,7 @@ def produtor_consumidor(qtd_numeros: int):
             time.sleep(0.5)
 
         # Grava 0 para encerrar o loop
-        fim = f"{0:<20}".encode()
+        fim = FORMATO_NUMERO.pack(0)
         os.write(id_produtor, fim)
 
         # Fecha a conexão
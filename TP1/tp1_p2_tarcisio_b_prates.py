@@ -8,16 +8,20 @@ Produtor-Consumidor multithreaded com memória compartilhada.
 - Consumidores testam primalidade
 - Termina quando M números forem processados (consumidos)
 - Script também roda experimentos para várias combinações e plota resultados
+- Backend alternativo com processos (multiprocessing.Queue) para paralelismo real sem a GIL
 """
 
 import threading
-import random
+import multiprocessing as mp
 import math
 import time
+import itertools
 import argparse
+from array import array
 import csv
 import os
 from collections import defaultdict
+import numpy as np
 import matplotlib
 matplotlib.use('Agg')  # Set the backend to a non-GUI one.
 
@@ -29,72 +33,221 @@ M_DEFAULT = 100_000  # total de números a serem processados (pode ajustar)
 TEST_REPEATS = 10
 N_values = [1, 10, 100, 1000]
 combos = [(1,1),(1,2),(1,4),(1,8),(2,1),(4,1),(8,1)]
+VALOR_MAX = 10**7  # produtores geram valores em [1, VALOR_MAX]
+BATCH = 64  # itens reservados por aquisição dos contadores produced/consumed
+LOG_SAMPLE_SHIFT = 6  # log de ocupação registra 1 a cada 2**6 = 64 operações
+READY_TIMEOUT = 60  # segundos para os processos filhos ficarem prontos (backend processes)
+SPSC_MIN_SIZE = 32  # abaixo disso o buffer enche/esvazia o tempo todo e a espera ativa perde para os semáforos
 # ---------------------------------------------------------
 
-def verifica_primo(n: int) -> bool:
+# Primos usados na divisão por tentativa (roda) antes do Miller-Rabin
+PRIMOS_PEQUENOS = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53)
+# Todo n sem fator em PRIMOS_PEQUENOS e menor que 59² é primo
+LIMITE_RODA = 59 * 59
+# Abaixo deste valor a divisão por tentativa ainda é mais barata que o Miller-Rabin
+LIMITE_DIVISAO = 100_000
+# Bases do Miller-Rabin determinístico: (2, 7, 61) vale para n < 4_759_123_141;
+# os 13 primeiros primos (até 41) valem para n < 3_317_044_064_679_887_385_961_981 (~3.3 * 10**24).
+# Acima disso o teste é apenas probabilístico (nenhum composto conhecido passa por essas bases).
+BASES_32 = (2, 7, 61)
+LIMITE_BASES_32 = 4_759_123_141
+BASES_64 = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+
+def verifica_primo_mr(n: int) -> bool:
     if n < 2:
         return False
-    if n == 2:
+
+    # Divisão pelos primos pequenos elimina a maior parte dos compostos
+    for p in PRIMOS_PEQUENOS:
+        if n % p == 0:
+            return n == p
+    if n < LIMITE_RODA:
         return True
-    if n % 2 == 0:
-        return False
-    raiz = int(math.sqrt(n)) + 1
-    for i in range(3, raiz, 2):
-        if n % i == 0:
+
+    # n pequeno: divisão por tentativa com raiz inteira (sem passar por float)
+    if n < LIMITE_DIVISAO:
+        limite = math.isqrt(n)
+        i = 59
+        while i <= limite:
+            if n % i == 0:
+                return False
+            i += 2
+        return True
+
+    # Miller-Rabin: n - 1 = 2^s * d, com d ímpar
+    s = ((n - 1) & -(n - 1)).bit_length() - 1
+    d = (n - 1) >> s
+
+    bases = BASES_32 if n < LIMITE_BASES_32 else BASES_64
+    for a in bases:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
             return False
     return True
 
 
+def gera_crivo(limite: int) -> np.ndarray:
+    """Crivo de Eratóstenes: crivo[n] é True se n for primo, para 0 <= n <= limite."""
+    crivo = np.ones(limite + 1, dtype=np.bool_)
+    crivo[:2] = False
+    crivo[4::2] = False
+    for i in range(3, math.isqrt(limite) + 1, 2):
+        if crivo[i]:
+            crivo[i*i::2*i] = False
+    return crivo
+
+
+# Calculado uma vez na importação: a verificação dos consumidores vira um acesso ao array
+CRIVO = gera_crivo(VALOR_MAX)
+
+
+# Consulta direta ao crivo: memoizar (lru_cache) ou compilar (Numba) não acelera, pois o
+# custo já é o de um acesso ao array, igual ao de um acerto no cache.
+def verifica_primo(n: int) -> bool:
+    if 0 <= n <= VALOR_MAX:
+        return bool(CRIVO[n])
+    return verifica_primo_mr(n)
+
+
+# Log de ocupação amostrado, em arrays pré-alocados (sem crescer lista durante o teste).
+class OccupancyLog:
+
+    def __init__(self, max_ops: int, start_time_ref):
+        n = (max_ops >> LOG_SAMPLE_SHIFT) + 1
+        self.ts = np.full(n, np.nan, dtype=np.float64)  # NaN = posição ainda não registrada
+        self.occ = np.empty(n, dtype=np.int32)
+        self.seq = itertools.count()  # next() é atômico sob a GIL
+        self.start_time_ref = start_time_ref
+
+    # Chamado fora do mutex do buffer, com a ocupação lida dentro dele
+    def record(self, count):
+        i = next(self.seq)
+        if i & ((1 << LOG_SAMPLE_SHIFT) - 1):
+            return
+        j = i >> LOG_SAMPLE_SHIFT
+        if j < len(self.ts):
+            self.occ[j] = count
+            self.ts[j] = time.perf_counter()  # por último: marca a posição como válida
+
+    # Lista de tuplas (timestamp relativo ao início, ocupação), ordenada pelo tempo
+    def to_list(self):
+        validos = ~np.isnan(self.ts)
+        ts, occ = self.ts[validos], self.occ[validos]
+        order = np.argsort(ts, kind="stable")
+        ts = ts[order] - self.start_time_ref[0]
+        return list(zip(ts.tolist(), occ[order].tolist()))
+
+
+# Contador sozinho em uma linha de cache de 64 bytes: índices escritos por threads em núcleos
+# diferentes não dividem a mesma linha. O alocador não alinha o buffer a 64 bytes, então
+# aloca 16 posições (128 bytes, que sempre contêm uma linha inteira) e devolve uma visão
+# de 1 posição no início dessa linha; contador[0] lê/escreve o valor.
+def novo_contador() -> memoryview:
+    buf = array('q', [0] * 16)
+    endereco = buf.buffer_info()[0]
+    pos = (-endereco % 64) // buf.itemsize
+    return memoryview(buf)[pos:pos + 1]  # a memoryview mantém buf vivo
+
+
 #Buffer circular compartilhado que gerencia a sincronização entre threads.
 class SharedBuffer:
 
-    def __init__(self, size: int, occupancy_log: list = None, start_time_ref=None):
+    def __init__(self, size: int, log: OccupancyLog = None):
         self.size = size
         self.buf = [None] * size
-        self.in_idx = 0
-        self.out_idx = 0
-        self.count = 0  # Contador de ocupação
+        self.in_idx = novo_contador()   # escrito pelos produtores
+        self.out_idx = novo_contador()  # escrito pelos consumidores
+        self.count = novo_contador()    # Contador de ocupação
 
-        self.occupancy_log = occupancy_log
-        self.start_time_ref = start_time_ref
+        self.log = log
 
         # semáforos
         self.empty = threading.Semaphore(size)  # Semáforo para contar as posições VAZIAS. Começa cheio (size)
         self.full = threading.Semaphore(0)      # Semáforo para contar as posições OCUPADAS. Começa vazio (0).
         self.mutex = threading.Lock()           # Lock (Mutex) para garantir que apenas uma thread modifique o buffer e os índices por vez.
 
-    def _log_occupancy(self):
-        if self.occupancy_log is not None and self.start_time_ref is not None:
-            # Registra uma tupla (timestamp, ocupação)
-            timestamp = time.perf_counter() - self.start_time_ref[0]
-            self.occupancy_log.append((timestamp, self.count))
+    def _log_occupancy(self, count):
+        if self.log is not None:
+            self.log.record(count)
 
     # Método usado pelo PRODUTOR para adicionar um item.
     def put(self, item):
         self.empty.acquire()      # Espera por uma vaga livre. Bloqueia se o buffer estiver cheio
         with self.mutex:
-            self.buf[self.in_idx] = item
-            self.in_idx = (self.in_idx + 1) % self.size
-            self.count += 1
-            self._log_occupancy()  # Log após produzir
+            self.buf[self.in_idx[0]] = item
+            self.in_idx[0] = (self.in_idx[0] + 1) % self.size
+            self.count[0] += 1
+            count = self.count[0]
         self.full.release()       # Sinaliza que uma nova vaga foi preenchida.
+        self._log_occupancy(count)  # Log após produzir (fora da seção crítica)
 
     # Método usado pelo CONSUMIDOR para retirar um item.
     def get(self):
         self.full.acquire()       # Espera por um item disponível
         with self.mutex:
-            item = self.buf[self.out_idx]
-            self.buf[self.out_idx] = None
-            self.out_idx = (self.out_idx + 1) % self.size
-            self.count -= 1
-            self._log_occupancy()  # Log após consumir
+            item = self.buf[self.out_idx[0]]
+            self.buf[self.out_idx[0]] = None
+            self.out_idx[0] = (self.out_idx[0] + 1) % self.size
+            self.count[0] -= 1
+            count = self.count[0]
         self.empty.release()      # Sinaliza que uma nova vaga ficou livre.
+        self._log_occupancy(count)  # Log após consumir (fora da seção crítica)
+        return item
+
+
+# Buffer circular sem locks para o caso de um único produtor e um único consumidor (Lamport).
+# Só o produtor escreve head e só o consumidor escreve tail; leituras e escritas de um int
+# são atômicas sob a GIL, então nenhum lock é necessário no caminho rápido.
+class SPSCBuffer:
+
+    def __init__(self, size: int, log: OccupancyLog = None):
+        self.size = size
+        # Capacidade arredondada para potência de 2: o módulo vira "& mask"
+        cap = 1 << max(size - 1, 0).bit_length()
+        self.mask = cap - 1
+        self.buf = [None] * cap
+        self.head = 0  # total de itens inseridos (escrito só pelo produtor)
+        self.tail = 0  # total de itens retirados (escrito só pelo consumidor)
+
+        self.log = log
+
+    def _log_occupancy(self):
+        if self.log is not None:
+            self.log.record(self.head - self.tail)
+
+    def put(self, item):
+        while self.head - self.tail == self.size:  # cheio: cede a CPU ao consumidor
+            time.sleep(0)
+        self.buf[self.head & self.mask] = item
+        self.head += 1
+        self._log_occupancy()
+
+    def get(self):
+        while self.head == self.tail:  # vazio: cede a CPU ao produtor
+            time.sleep(0)
+        idx = self.tail & self.mask
+        item = self.buf[idx]
+        self.buf[idx] = None
+        self.tail += 1
+        self._log_occupancy()
         return item
 
+def gera_valores(M, seed=None) -> np.ndarray:
+    """Sorteia de uma vez os M valores em [1, VALOR_MAX] que os produtores vão inserir."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(1, VALOR_MAX + 1, size=M)
+
 def run_trial(N, Np, Nc, M, seed=None, verbose=False, generate_log=False):
 
-    if seed is not None:
-        random.seed(seed)
+    # Valores pré-sorteados: cada produtor lê a faixa que reservou no contador
+    values = gera_valores(M, seed)
 
     buf = SharedBuffer(N)  # Instancia o buffer.
 
@@ -112,51 +265,52 @@ def run_trial(N, Np, Nc, M, seed=None, verbose=False, generate_log=False):
         nonlocal produced_total
         start_event.wait()
         while True:
-            # decide se ainda precisamos produzir
+            # reserva um lote de até BATCH itens de uma vez (um lock por lote, não por item)
             with produced_lock:
-                if produced_total >= M:
-                    break
-                produced_total += 1
-            # gera valor aleatório e coloca no buffer
-            val = random.randint(1, 10**7)
-            buf.put(val)
-            if verbose and (produced_total % 10000 == 0):
-                print(f"[P{tid}] produziu {produced_total}")
+                local_left = min(BATCH, M - produced_total)
+                produced_total += local_left
+                cur = produced_total
+            if local_left <= 0:
+                break
+            # coloca no buffer os valores da faixa reservada [cur - local_left, cur)
+            for val in values[cur - local_left:cur].tolist():
+                buf.put(val)
+            if verbose and (cur // 10000 != (cur - local_left) // 10000):
+                print(f"[P{tid}] produziu {cur}")
 
     # Thread consumidor
     def consumer_thread_fn(tid):
         nonlocal consumed_total
         start_event.wait()
         while True:
-            # Se já consumimos M, não pegar mais itens
-            with consumed_lock:
-                if consumed_total >= M:
-                    break
-            # pegar um item (irá bloquear se vazio)
-            item = buf.get()
-            # testar primalidade (custo computacional)
-            if item is None:
-                break
-
-            is_p = verifica_primo(item)
-            # incrementar contador consumido
+            # reserva um lote de até BATCH itens; como o total reservado é exatamente M,
+            # cada item reservado será produzido e nenhuma sentinela é necessária
             with consumed_lock:
-                consumed_total += 1
+                local_left = min(BATCH, M - consumed_total)
+                consumed_total += local_left
                 cur = consumed_total
-            if verbose and (cur % 10000 == 0):
-                print(f"[C{tid}] consumiu {cur} (valor={item}, primo={is_p})")
-            # se atingiu M, podemos terminar
-            if cur >= M:
+            if local_left <= 0:
                 break
+            for _ in range(local_left):
+                # pegar um item (irá bloquear se vazio)
+                item = buf.get()
+                # testar primalidade (custo computacional)
+                is_p = verifica_primo(item)
+            if verbose and (cur // 10000 != (cur - local_left) // 10000):
+                print(f"[C{tid}] consumiu {cur} (valor={item}, primo={is_p})")
 
-    occupancy_log = []
-    # Usamos uma lista para t0 ser mutável e acessível por _log_occupancy
+    # Usamos uma lista para t0 ser mutável e acessível pelo OccupancyLog
     start_time_ref = [-1.0]
 
+    # Com um produtor e um consumidor não há disputa: usa o buffer sem locks
+    use_spsc = Np == 1 and Nc == 1 and N >= SPSC_MIN_SIZE
+    buffer_cls = SPSCBuffer if use_spsc else SharedBuffer
+
     if generate_log:
-        buf = SharedBuffer(N, occupancy_log=occupancy_log, start_time_ref=start_time_ref)
+        # Cada item passa por um put e um get: no máximo 2*M operações registradas
+        buf = buffer_cls(N, log=OccupancyLog(2 * M, start_time_ref))
     else:
-        buf = SharedBuffer(N)
+        buf = buffer_cls(N)
 
     # criar threads
     producers = [threading.Thread(target=producer_thread_fn, args=(i+1,)) for i in range(Np)]
@@ -174,11 +328,7 @@ def run_trial(N, Np, Nc, M, seed=None, verbose=False, generate_log=False):
     for p in producers:
         p.join()
     # producers finished producing M items, but there might remain items to consume;
-    # wait for consumers to finish (they stop when consumed_total >= M)
-
-    for _ in range(Nc):
-        buf.put(None)
-
+    # wait for consumers to finish (each one consumes exactly what it reserved)
     for c in consumers:
         c.join()
     tf = time.perf_counter()
@@ -190,9 +340,121 @@ def run_trial(N, Np, Nc, M, seed=None, verbose=False, generate_log=False):
     if consumed_total < M:
         print("Aviso: foram consumidos menos que M (problema).")
 
+    occupancy_log = buf.log.to_list() if buf.log is not None else []
+    return total_time, occupancy_log
+
+# Processo produtor (nível de módulo para poder ser usado com o método "spawn")
+def producer_process_fn(tid, queue, produced_total, M, ready, start_event, values, verbose):
+    try:
+        ready.wait()  # avisa que terminou de iniciar (imports, CRIVO)
+    except threading.BrokenBarrierError:  # o principal desistiu de esperar: apenas encerra
+        return
+    start_event.wait()
+    while True:
+        with produced_total.get_lock():
+            local_left = min(BATCH, M - produced_total.value)
+            produced_total.value += local_left
+            cur = produced_total.value
+        if local_left <= 0:
+            break
+        for val in values[cur - local_left:cur].tolist():
+            queue.put(val)
+        if verbose and (cur // 10000 != (cur - local_left) // 10000):
+            print(f"[P{tid}] produziu {cur}")
+
+# Processo consumidor
+def consumer_process_fn(tid, queue, consumed_total, M, ready, start_event, verbose):
+    try:
+        ready.wait()  # avisa que terminou de iniciar (imports, CRIVO)
+    except threading.BrokenBarrierError:  # o principal desistiu de esperar: apenas encerra
+        return
+    start_event.wait()
+    while True:
+        with consumed_total.get_lock():
+            local_left = min(BATCH, M - consumed_total.value)
+            consumed_total.value += local_left
+            cur = consumed_total.value
+        if local_left <= 0:
+            break
+        for _ in range(local_left):
+            item = queue.get()
+            is_p = verifica_primo(item)
+        if verbose and (cur // 10000 != (cur - local_left) // 10000):
+            print(f"[C{tid}] consumiu {cur} (valor={item}, primo={is_p})")
+
+def run_trial_processes(N, Np, Nc, M, seed=None, verbose=False, generate_log=False):
+    """
+    Mesmo experimento de run_trial, mas com Np/Nc processos e uma multiprocessing.Queue
+    de capacidade N no lugar do SharedBuffer: o teste de primalidade roda em paralelo
+    de fato, sem disputar a GIL.
+    """
+    values = gera_valores(M, seed)
+    queue = mp.Queue(maxsize=N)
+    produced_total = mp.Value('q', 0)
+    consumed_total = mp.Value('q', 0)
+    start_event = mp.Event()
+    # Todos os processos + o principal: o tempo só começa a contar com os filhos prontos,
+    # fora da medição a inicialização do interpretador (relevante com "spawn"/"forkserver")
+    ready = mp.Barrier(Np + Nc + 1)
+
+    producers = [mp.Process(target=producer_process_fn,
+                            args=(i+1, queue, produced_total, M, ready, start_event, values, verbose))
+                 for i in range(Np)]
+    consumers = [mp.Process(target=consumer_process_fn,
+                            args=(i+1, queue, consumed_total, M, ready, start_event, verbose))
+                 for i in range(Nc)]
+    for p in producers + consumers:
+        p.daemon = True
+        p.start()
+
+    # Ocupação amostrada por uma thread monitora via qsize()
+    occupancy_log = []
+    monitor_stop = threading.Event()
+
+    def monitor_fn():
+        while not monitor_stop.is_set():
+            try:
+                occupancy_log.append((time.perf_counter() - t0, queue.qsize()))
+            except NotImplementedError:  # macOS não implementa qsize()
+                return
+            time.sleep(0.001)
+
+    # aguarda todos os filhos ficarem prontos; se algum morrer antes, não trava o experimento
+    try:
+        ready.wait(timeout=READY_TIMEOUT)
+    except threading.BrokenBarrierError:
+        for p in producers + consumers:
+            p.terminate()
+        for p in producers + consumers:
+            p.join()
+        exitcodes = [p.exitcode for p in producers + consumers]
+        raise RuntimeError(f"Processos filhos não ficaram prontos em {READY_TIMEOUT}s (exitcodes={exitcodes})")
+    t0 = time.perf_counter()
+    start_event.set()  # libera início simultâneo
+    monitor = threading.Thread(target=monitor_fn, daemon=True)
+    if generate_log:
+        monitor.start()
+
+    for p in producers + consumers:
+        p.join()
+    tf = time.perf_counter()
+    total_time = tf - t0
+
+    monitor_stop.set()
+    if generate_log:
+        monitor.join()
+
+    if produced_total.value < M:
+        print("Aviso: foram produzidos menos que M (problema).")
+    if consumed_total.value < M:
+        print("Aviso: foram consumidos menos que M (problema).")
+
     return total_time, occupancy_log
 
-def run_experiments(M=M_DEFAULT, repeats=TEST_REPEATS, out_csv="results.csv", verbose=False):
+# Backends disponíveis para os experimentos
+BACKENDS = {"threads": run_trial, "processes": run_trial_processes}
+
+def run_experiments(M=M_DEFAULT, repeats=TEST_REPEATS, out_csv="results.csv", verbose=False, backend="threads"):
     """Executa experimentos para todas as combinações e grava CSV com médias."""
     results = []  # linhas: (N, Np, Nc, repeat_index, time)
     summary = defaultdict(list)  # keys: (N,Np,Nc) -> list times
@@ -205,7 +467,7 @@ def run_experiments(M=M_DEFAULT, repeats=TEST_REPEATS, out_csv="results.csv", ve
             for r in range(repeats):
                 runcount += 1
                 print(f"Run {runcount}/{total_runs}: N={N} Np={Np} Nc={Nc} rep={r+1}")
-                t, _ = run_trial(N, Np, Nc, M, seed=None, verbose=verbose)
+                t, _ = BACKENDS[backend](N, Np, Nc, M, seed=None, verbose=verbose)
                 results.append((N, Np, Nc, r+1, t))
                 summary[(N,Np,Nc)].append(t)
 
@@ -286,9 +548,12 @@ def main():
     parser.add_argument("--csv", type=str, default="results.csv", help="Arquivo CSV de saida")
     parser.add_argument("--plot", type=str, default="plot.png", help="Arquivo PNG do grafico")
     parser.add_argument("--verbose", action="store_true", help="Imprime logs durante execucao")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="threads",
+                        help="threads (memória compartilhada) ou processes (multiprocessing)")
     args = parser.parse_args()
+    trial_fn = BACKENDS[args.backend]
 
-    #mean_results, csv_file = run_experiments(M=args.M, repeats=args.repeats, out_csv=args.csv, verbose=args.verbose)
+    #mean_results, csv_file = run_experiments(M=args.M, repeats=args.repeats, out_csv=args.csv, verbose=args.verbose, backend=args.backend)
     #plot_results(mean_results, out_png=args.plot)
     #print("Execução finalizada. CSV:", csv_file)
 
@@ -296,15 +561,15 @@ def main():
     print("\nGerando gráficos de ocupação para cenários específicos...")
 
     # Cenário 1: Eficiente e Desacoplado
-    _, log1 = run_trial(N=1000, Np=1, Nc=8, M=M_DEFAULT, generate_log=True)
+    _, log1 = trial_fn(N=1000, Np=1, Nc=8, M=M_DEFAULT, generate_log=True)
     plot_occupancy(log1, "Cenário 1: Eficiente (N=1000, Np=1, Nc=8)", "occupancy_efficient.png")
 
     # Cenário 2: Consumidores famintos (alta contenção)
-    _, log2 = run_trial(N=10, Np=1, Nc=8, M=M_DEFAULT, generate_log=True)
+    _, log2 = trial_fn(N=10, Np=1, Nc=8, M=M_DEFAULT, generate_log=True)
     plot_occupancy(log2, "Cenário 2: Contenção de Consumidores (N=10, Np=1, Nc=8)", "occupancy_consumer_starved.png")
 
     # Cenário 3: Produtores bloqueados (gargalo no consumidor)
-    _, log3 = run_trial(N=100, Np=8, Nc=1, M=M_DEFAULT, generate_log=True)
+    _, log3 = trial_fn(N=100, Np=8, Nc=1, M=M_DEFAULT, generate_log=True)
     plot_occupancy(log3, "Cenário 3: Gargalo no Consumidor (N=100, Np=8, Nc=1)", "occupancy_producer_blocked.png")
 
 if __name__ == "__main__":
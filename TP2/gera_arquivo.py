@@ -26,14 +26,8 @@ def sha256_arquivo(path):
     """
     Calcula o SHA-256 do arquivo gerado.
     """
-    h = hashlib.sha256()
     with open(path, "rb") as f:
-        while True:
-            bloco = f.read(65536)
-            if not bloco:
-                break
-            h.update(bloco)
-    return h.hexdigest()
+        return hashlib.file_digest(f, "sha256").hexdigest()
 
 
 if __name__ == "__main__":
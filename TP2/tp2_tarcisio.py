@@ -25,6 +25,8 @@ import os
 import hashlib
 import time
 import logging
+import selectors
+from collections import deque
 
 
 # --------------------------------------------------------------
@@ -37,17 +39,70 @@ logging.basicConfig(
 )
 
 
+# --------------------------------------------------------------
+# PARÂMETROS DO PROTOCOLO
+# --------------------------------------------------------------
+
+# Máximo de blocos contíguos pedidos em um único REQUEST_RANGE
+BLOCOS_POR_PEDIDO = 64
+
+# Códigos de operação: 1º byte de cada mensagem
+OP_METADATA = 1        # [op]
+OP_METADATA_REPLY = 2  # [op] + JSON com os metadados (troca única, fora do caminho crítico)
+OP_REQUEST = 3         # [op][índice]
+OP_BLOCK = 4           # [op][índice][tamanho do bloco] + dados do bloco
+OP_REQUEST_RANGE = 5   # [op][início][fim]
+OP_RANGE_REPLY = 6     # [op][quantidade de blocos OP_BLOCK que virão em seguida]
+OP_ERROR = 7           # [op]
+
+# Cabeçalho binário de tamanho fixo de cada operação
+FORMATOS = {
+    OP_METADATA: struct.Struct('!B'),
+    OP_METADATA_REPLY: struct.Struct('!B'),
+    OP_REQUEST: struct.Struct('!BI'),
+    OP_BLOCK: struct.Struct('!BIQ'),
+    OP_REQUEST_RANGE: struct.Struct('!BII'),
+    OP_RANGE_REPLY: struct.Struct('!BI'),
+    OP_ERROR: struct.Struct('!B'),
+}
+
+
 # --------------------------------------------------------------
 # FUNÇÕES AUXILIARES DE ENVIO E RECEBIMENTO
 # --------------------------------------------------------------
 
-def enviar_frame(conn, payload: bytes):
+def enviar_frame(conn, *partes):
     """
     Envia uma mensagem com cabeçalho contendo o tamanho (4 bytes).
     Isso evita problemas na rede ("message framing").
+
+    As partes (cabeçalho, dados...) vão em uma única chamada sendmsg
+    (scatter-gather), sem concatená-las em um novo bytes.
     """
-    tamanho = struct.pack('!I', len(payload))
-    conn.sendall(tamanho + payload)
+    total = sum(len(p) for p in partes)
+    segmentos = [struct.pack('!I', total), *partes]
+
+    if not hasattr(conn, "sendmsg"):  # plataformas sem sendmsg (ex.: Windows)
+        conn.sendall(b''.join(segmentos))
+        return
+
+    enviado = conn.sendmsg(segmentos)
+    if enviado < 4 + total:
+        # Envio parcial (buffer do socket cheio): completa o restante
+        conn.sendall(b''.join(segmentos)[enviado:])
+
+
+def receber_exato(conn, tam: int) -> bytes:
+    """
+    Lê exatamente tam bytes do socket (recv pode devolver menos que o pedido).
+    """
+    dados = bytearray()
+    while len(dados) < tam:
+        parte = conn.recv(tam - len(dados))
+        if not parte:
+            raise ConnectionError("Conexão interrompida durante recebimento")
+        dados += parte
+    return bytes(dados)
 
 
 def receber_frame(conn) -> bytes:
@@ -59,16 +114,34 @@ def receber_frame(conn) -> bytes:
     if not header:
         raise ConnectionError("Conexão fechada ao ler cabeçalho")
 
+    # Com vários frames em sequência o cabeçalho pode chegar fragmentado
+    if len(header) < 4:
+        header += receber_exato(conn, 4 - len(header))
+
     (tam,) = struct.unpack('!I', header)
-    dados = b''
+    return receber_exato(conn, tam)
 
-    while len(dados) < tam:
-        parte = conn.recv(tam - len(dados))
-        if not parte:
-            raise ConnectionError("Conexão interrompida durante recebimento")
-        dados += parte
 
-    return dados
+def enviar_msg(conn, op, *campos, payload: bytes = b''):
+    """
+    Envia a mensagem [op][campos][payload] em um único frame: cabeçalho e payload
+    seguem como segmentos separados de um único sendmsg (ver enviar_frame).
+    """
+    enviar_frame(conn, FORMATOS[op].pack(op, *campos), payload)
+
+
+def receber_msg(conn):
+    """
+    Recebe uma mensagem e devolve (op, campos, payload).
+    """
+    frame = receber_frame(conn)
+    op = frame[0]
+    if op not in FORMATOS:
+        raise ValueError(f"Operação desconhecida: {op}")
+
+    formato = FORMATOS[op]
+    campos = formato.unpack_from(frame)[1:]
+    return op, campos, frame[formato.size:]
 
 
 # --------------------------------------------------------------
@@ -99,52 +172,89 @@ class Peer:
         self.sha256_original = None
 
         # Armazenamento dos blocos
-        self.blocos = {}      # índice → bytes
-        self.tenho = set()    # conjunto com índices que este peer já possui
+        self.blocos = []          # índice → bytes (num_blocos posições, alocada ao receber os metadados)
+        self.tenho = bytearray()  # bitmap: bit idx ligado se este peer já possui o bloco idx
+        self.qtd_tenho = 0        # quantidade de bits ligados em self.tenho
+        self.tenho_lock = threading.Lock()  # protege blocos, tenho e qtd_tenho nas escritas
+
+        # Fila de blocos ainda não reservados por nenhum worker (cliente)
+        self.faltam = deque()
+        self.faltam_lock = threading.Lock()
 
         # Controle de parada
         self.encerrar = threading.Event()
+        # Par de sockets usado para acordar o select do servidor ao encerrar (self-pipe)
+        self.aviso_leitura, self.aviso_escrita = socket.socketpair()
+        self.completo = threading.Event()  # sinalizado quando o último bloco chega
 
         logging.info(f"[Peer {self.port}] Inicializado")
 
     # ----------------------------------------------------------
-    # PREPARAÇÃO DO SEEDER (carrega o arquivo e fragmenta)
+    # PREPARAÇÃO DO SEEDER (calcula metadados do arquivo)
     # ----------------------------------------------------------
 
     def preparar_seeder(self):
         """
-        Seeder carrega o arquivo, calcula hash e fragmenta em blocos.
+        Seeder calcula tamanho, número de blocos e hash do arquivo.
+        Os blocos não são carregados na memória: são enviados direto do disco.
         """
         if not self.arquivo_seed:
             raise ValueError("Seeder precisa fornecer --file")
 
         self.nome_arquivo = os.path.basename(self.arquivo_seed)
-        self.tamanho_arquivo = os.path.getsize(self.arquivo_seed)
+
+        # Uma única abertura e uma única leitura: tamanho (fstat) e SHA-256 do mesmo descritor
+        with open(self.arquivo_seed, "rb") as f:
+            self.tamanho_arquivo = os.fstat(f.fileno()).st_size
+            self.sha256_original = hashlib.file_digest(f, "sha256").hexdigest()
 
         # Calcula número total de blocos
         self.num_blocos = (self.tamanho_arquivo + self.tamanho_bloco - 1) // self.tamanho_bloco
 
-        # Calcula SHA-256 do arquivo completo
-        h = hashlib.sha256()
-        with open(self.arquivo_seed, "rb") as f:
-            while True:
-                chunk = f.read(65536)
-                if not chunk:
-                    break
-                h.update(chunk)
-        self.sha256_original = h.hexdigest()
-
         logging.info(f"[Seeder] Arquivo: {self.nome_arquivo}")
         logging.info(f"[Seeder] Tamanho: {self.tamanho_arquivo} bytes")
         logging.info(f"[Seeder] Blocos: {self.num_blocos}")
         logging.info(f"[Seeder] SHA-256: {self.sha256_original}")
 
-        # Carrega os blocos na memória
-        with open(self.arquivo_seed, "rb") as f:
-            for i in range(self.num_blocos):
-                bloco = f.read(self.tamanho_bloco)
-                self.blocos[i] = bloco
-                self.tenho.add(i)
+        self.alocar_blocos(completo=True)
+
+    # ----------------------------------------------------------
+    # CONTROLE DOS BLOCOS QUE ESTE PEER POSSUI (bitmap)
+    # ----------------------------------------------------------
+
+    def alocar_blocos(self, completo=False):
+        """
+        Aloca o bitmap com 1 bit por bloco. completo=True (Seeder) marca todos
+        os blocos; senão aloca também a lista que vai guardar os blocos baixados.
+        """
+        tam = (self.num_blocos + 7) // 8
+        with self.tenho_lock:
+            if completo:
+                self.tenho = bytearray(b'\xff' * tam)
+                if self.num_blocos % 8:
+                    self.tenho[-1] = (1 << (self.num_blocos % 8)) - 1
+                self.qtd_tenho = self.num_blocos
+            else:
+                self.blocos = [None] * self.num_blocos
+                self.tenho = bytearray(tam)
+                self.qtd_tenho = 0
+
+    def tem_bloco(self, idx):
+        # Leitura de um único byte: atômica sob a GIL, dispensa o lock
+        byte = idx >> 3
+        return byte < len(self.tenho) and bool(self.tenho[byte] & (1 << (idx & 7)))
+
+    def guardar_bloco(self, idx, dados):
+        """
+        Guarda um bloco recebido. Devolve True se era o último que faltava.
+        """
+        with self.tenho_lock:
+            if self.tem_bloco(idx):
+                return False
+            self.blocos[idx] = dados
+            self.tenho[idx >> 3] |= 1 << (idx & 7)
+            self.qtd_tenho += 1
+            return self.qtd_tenho == self.num_blocos
 
     # ----------------------------------------------------------
     # SERVIDOR TCP (cada peer aceita pedidos de blocos)
@@ -160,62 +270,110 @@ class Peer:
 
         logging.info(f"[Peer {self.port}] Servidor ouvindo...")
 
+        # Bloqueia no select até chegar conexão ou aviso de encerramento (sem acordar à toa)
+        sel = selectors.DefaultSelector()
+        sel.register(sock, selectors.EVENT_READ)
+        sel.register(self.aviso_leitura, selectors.EVENT_READ)
+
         while not self.encerrar.is_set():
-            try:
-                sock.settimeout(1)
+            for key, _ in sel.select():
+                if key.fileobj is not sock:
+                    continue
+
                 conn, addr = sock.accept()
-            except socket.timeout:
-                continue
 
-            threading.Thread(target=self.tratar_conexao, args=(conn, addr), daemon=True).start()
+                # A conexão é persistente (vários pedidos seguidos): sem Nagle, as respostas
+                # não ficam esperando o ACK atrasado do pedido anterior
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+                threading.Thread(target=self.tratar_conexao, args=(conn, addr), daemon=True).start()
+
+        sel.close()
+        sock.close()
+
+    def parar(self):
+        """
+        Sinaliza o encerramento e acorda o servidor bloqueado no select.
+        """
+        self.encerrar.set()
+        self.aviso_escrita.send(b'\0')
+
+    # ----------------------------------------------------------
+    # ENVIO DE UM BLOCO (servidor)
+    # ----------------------------------------------------------
+
+    def tamanho_do_bloco(self, idx):
+        return min(self.tamanho_bloco, self.tamanho_arquivo - idx * self.tamanho_bloco)
+
+    def enviar_bloco(self, conn, idx, arquivo):
+        """
+        Envia a mensagem OP_BLOCK do bloco idx.
+        Se arquivo (Seeder) for dado, os dados vão do disco para o socket via
+        sendfile, sem cópia para o espaço do usuário.
+        """
+        tam = self.tamanho_do_bloco(idx)
+        if arquivo is None:
+            enviar_msg(conn, OP_BLOCK, idx, tam, payload=self.blocos[idx])
+            return
+
+        cabecalho = FORMATOS[OP_BLOCK].pack(OP_BLOCK, idx, tam)
+        conn.sendall(struct.pack('!I', len(cabecalho) + tam) + cabecalho)
+        conn.sendfile(arquivo, offset=idx * self.tamanho_bloco, count=tam)
 
     # ----------------------------------------------------------
     # TRATAMENTO DE UMA CONEXÃO ENTRANTE (servidor)
     # ----------------------------------------------------------
 
     def tratar_conexao(self, conn, addr):
+        # Seeder: um descritor por conexão, já que sendfile pode mover a posição do arquivo
+        arquivo = open(self.arquivo_seed, "rb") if self.is_seed else None
         try:
             while True:
-                dados = receber_frame(conn)
-                msg = json.loads(dados.decode())
-                tipo = msg["type"]
+                op, campos, _ = receber_msg(conn)
 
                 # Pedido de metadados
-                if tipo == "METADATA":
+                if op == OP_METADATA:
                     resposta = {
-                        "type": "METADATA_REPLY",
                         "filename": self.nome_arquivo,
                         "filesize": self.tamanho_arquivo,
                         "blocksize": self.tamanho_bloco,
                         "num_blocks": self.num_blocos,
                         "sha256": self.sha256_original
                     }
-                    enviar_frame(conn, json.dumps(resposta).encode())
+                    enviar_msg(conn, OP_METADATA_REPLY, payload=json.dumps(resposta).encode())
 
                 # Pedido de bloco
-                elif tipo == "REQUEST":
-                    idx = msg["block_index"]
-                    if idx in self.tenho:
-                        # Envia header
-                        header = {
-                            "type": "BLOCK",
-                            "block_index": idx,
-                            "block_len": len(self.blocos[idx]),
-                        }
-                        enviar_frame(conn, json.dumps(header).encode())
-
-                        # Envia bloco bruto
-                        enviar_frame(conn, self.blocos[idx])
-
+                elif op == OP_REQUEST:
+                    (idx,) = campos
+                    if self.tem_bloco(idx):
+                        self.enviar_bloco(conn, idx, arquivo)
                         logging.info(f"[Peer {self.port}] Enviou bloco {idx} para {addr}")
+                    else:
+                        enviar_msg(conn, OP_ERROR)
+
+                # Pedido de um intervalo [start, end) de blocos: responde com a quantidade
+                # que possui e envia os blocos em sequência, sem esperar novos pedidos
+                elif op == OP_REQUEST_RANGE:
+                    inicio, fim = campos
+                    # Limita o intervalo: um fim arbitrário do cliente não pode prender esta thread
+                    fim = min(fim, self.num_blocos or 0, inicio + BLOCOS_POR_PEDIDO)
+                    indices = [i for i in range(inicio, fim) if self.tem_bloco(i)]
+                    enviar_msg(conn, OP_RANGE_REPLY, len(indices))
+
+                    for idx in indices:
+                        self.enviar_bloco(conn, idx, arquivo)
+
+                    logging.info(f"[Peer {self.port}] Enviou {len(indices)} blocos para {addr}")
 
                 else:
-                    enviar_frame(conn, json.dumps({"type": "ERROR"}).encode())
+                    enviar_msg(conn, OP_ERROR)
 
         except:
             pass
         finally:
             conn.close()
+            if arquivo is not None:
+                arquivo.close()
 
     # ----------------------------------------------------------
     # CLIENTE: baixa blocos dos vizinhos
@@ -228,6 +386,10 @@ class Peer:
         if not self.is_seed:
             self.obter_metadata()
 
+        self.faltam = deque(i for i in range(self.num_blocos) if not self.tem_bloco(i))
+        if self.qtd_tenho == self.num_blocos:
+            self.completo.set()
+
         # Spawna uma thread por vizinho para pedir blocos
         workers = []
         for v in self.vizinhos:
@@ -235,10 +397,9 @@ class Peer:
             t.start()
             workers.append(t)
 
-        # Acompanha progresso
-        while len(self.tenho) < self.num_blocos:
-            logging.info(f"[Peer {self.port}] Progresso: {len(self.tenho)}/{self.num_blocos} blocos")
-            time.sleep(1)
+        # Acompanha progresso: wait retorna assim que o último bloco chega
+        while not self.completo.wait(timeout=1):
+            logging.info(f"[Peer {self.port}] Progresso: {self.qtd_tenho}/{self.num_blocos} blocos")
 
         # Depois de completo
         logging.info(f"[Peer {self.port}] Todos os blocos recebidos!")
@@ -256,14 +417,18 @@ class Peer:
             host, port = viz.split(":")
             try:
                 conn = socket.create_connection((host, int(port)), timeout=2)
-                enviar_frame(conn, json.dumps({"type": "METADATA"}).encode())
-                resp = json.loads(receber_frame(conn).decode())
+                enviar_msg(conn, OP_METADATA)
+                op, _, payload = receber_msg(conn)
+                if op != OP_METADATA_REPLY:
+                    raise ValueError("Resposta inesperada ao pedido de metadados")
+                resp = json.loads(payload.decode())
 
                 self.nome_arquivo = resp["filename"]
                 self.tamanho_arquivo = resp["filesize"]
                 self.tamanho_bloco = resp["blocksize"]
                 self.num_blocos = resp["num_blocks"]
                 self.sha256_original = resp["sha256"]
+                self.alocar_blocos()
 
                 logging.info(f"[Peer {self.port}] Metadados recebidos de {viz}")
                 conn.close()
@@ -274,6 +439,36 @@ class Peer:
         logging.error("Não foi possível obter os metadados de nenhum vizinho.")
         exit()
 
+    # ----------------------------------------------------------
+    # FILA DE BLOCOS QUE FALTAM (compartilhada entre os workers)
+    # ----------------------------------------------------------
+
+    def reservar_sequencia(self):
+        """
+        Retira da fila a próxima sequência contígua de blocos (até BLOCOS_POR_PEDIDO)
+        e devolve o intervalo [inicio, fim), ou None se a fila estiver vazia.
+        """
+        with self.faltam_lock:
+            if not self.faltam:
+                return None
+            inicio = self.faltam.popleft()
+            fim = inicio + 1
+            while self.faltam and self.faltam[0] == fim and fim - inicio < BLOCOS_POR_PEDIDO:
+                self.faltam.popleft()
+                fim += 1
+            return inicio, fim
+
+    def devolver_blocos(self, indices, no_inicio):
+        """
+        Devolve à fila blocos reservados que não foram recebidos. no_inicio=True
+        (falha de conexão) faz outro worker tentá-los primeiro; senão vão para o fim.
+        """
+        with self.faltam_lock:
+            if no_inicio:
+                self.faltam.extendleft(reversed(indices))
+            else:
+                self.faltam.extend(indices)
+
     # ----------------------------------------------------------
     # WORKER: cada thread tenta baixar blocos que faltam
     # ----------------------------------------------------------
@@ -282,51 +477,76 @@ class Peer:
         host, port = viz.split(":")
         port = int(port)
 
-        while len(self.tenho) < self.num_blocos:
-            faltam = [i for i in range(self.num_blocos) if i not in self.tenho]
-            if not faltam:
-                break
+        # Uma única conexão por vizinho, reaproveitada para todos os pedidos
+        conn = None
 
-            idx = faltam[0]  # estratégia simples: pega o primeiro que falta
+        while not self.completo.is_set():
+            # Pede a próxima sequência contígua de blocos que faltam (limitada)
+            sequencia = self.reservar_sequencia()
+            if sequencia is None:
+                # Tudo reservado: espera, pois um pedido em andamento pode falhar e devolver blocos
+                self.completo.wait(timeout=0.05)
+                continue
+            inicio, fim = sequencia
 
             try:
-                conn = socket.create_connection((host, port), timeout=3)
-
-                enviar_frame(conn, json.dumps({
-                    "type": "REQUEST",
-                    "block_index": idx
-                }).encode())
-
-                header = json.loads(receber_frame(conn).decode())
-
-                if header["type"] == "BLOCK":
-                    dados = receber_frame(conn)
-                    self.blocos[idx] = dados
-                    self.tenho.add(idx)
+                if conn is None:
+                    conn = socket.create_connection((host, port), timeout=3)
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+                enviar_msg(conn, OP_REQUEST_RANGE, inicio, fim)
+
+                op, campos, _ = receber_msg(conn)
+
+                if op == OP_RANGE_REPLY:
+                    (quantidade,) = campos
+                    for _ in range(quantidade):
+                        op, campos, dados = receber_msg(conn)
+                        if op != OP_BLOCK:
+                            raise ValueError("Esperado OP_BLOCK")
+                        (idx, tam) = campos
+                        # Bloco fora do intervalo pedido ou com tamanho errado: descarta o pedido
+                        # (o except devolve os blocos à fila e reabre a conexão)
+                        if not (inicio <= idx < fim and len(dados) == tam == self.tamanho_do_bloco(idx)):
+                            raise ValueError(f"Bloco {idx} inválido recebido de {viz}")
+                        if self.guardar_bloco(idx, dados):
+                            self.completo.set()
+
+                    logging.info(f"[Peer {self.port}] Recebeu {quantidade} blocos [{inicio}, {fim}) de {viz}")
+
+                # Blocos que o vizinho não tinha voltam para o fim da fila
+                nao_recebidos = [i for i in range(inicio, fim) if not self.tem_bloco(i)]
+                if nao_recebidos:
+                    self.devolver_blocos(nao_recebidos, no_inicio=False)
+                    time.sleep(0.2)
 
-                    logging.info(f"[Peer {self.port}] Recebeu bloco {idx} de {viz}")
-
-                conn.close()
             except:
+                self.devolver_blocos([i for i in range(inicio, fim) if not self.tem_bloco(i)], no_inicio=True)
+
+                # Conexão em estado desconhecido: descarta e reabre na próxima tentativa
+                if conn is not None:
+                    conn.close()
+                    conn = None
                 time.sleep(0.2)
 
+        if conn is not None:
+            conn.close()
+
     # ----------------------------------------------------------
     # RECONSTRUÇÃO DO ARQUIVO FINAL
     # ----------------------------------------------------------
 
     def reconstruir_arquivo(self):
         with open(self.arquivo_saida, "wb") as f:
-            for i in range(self.num_blocos):
-                f.write(self.blocos[i])
+            f.writelines(self.blocos)
 
         logging.info(f"[Peer {self.port}] Arquivo reconstruído em: {self.arquivo_saida}")
 
-        # Checar integridade
-        h = hashlib.sha256()
+        # Checar integridade (sem carregar o arquivo inteiro na memória)
         with open(self.arquivo_saida, "rb") as f:
-            h.update(f.read())
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
 
-        if h.hexdigest() == self.sha256_original:
+        if digest == self.sha256_original:
             logging.info("[OK] SHA-256 confere! Arquivo íntegro.")
         else:
             logging.warning("[ERRO] SHA-256 não confere!")
@@ -354,7 +574,7 @@ class Peer:
                     time.sleep(1)
             except KeyboardInterrupt:
                 logging.info(f"[Peer {self.port}] Encerrando Seeder...")
-                self.encerrar.set()
+                self.parar()
 
         else:
             # Leecher: inicia servidor e cliente normalmente